@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from chattr.app.runner import app
+from chattr.app.runner import get_app
 
 if TYPE_CHECKING:
     from gradio import Blocks
@@ -8,8 +8,10 @@ if TYPE_CHECKING:
 
 def main() -> None:
     """Launch the Gradio Multi-agent system app."""
-    application: Blocks = app.gui()
+    application: Blocks = get_app().gui()
     application.queue(api_open=True)
+    # uvicorn serves the app, and the streamed responses, on uvloop when it is
+    # installed.
     application.launch(
         debug=True,
         enable_monitoring=True,
@@ -1,40 +1,204 @@
 """Main orchestration graph for the Chattr application."""
 
+from asyncio import (
+    Lock,
+    Queue,
+    Semaphore,
+    Task,
+    TaskGroup,
+    create_task,
+    gather,
+    to_thread,
+)
+from collections import OrderedDict
 from collections.abc import AsyncGenerator
-from json import dumps, loads
+from contextlib import aclosing
+from functools import lru_cache
+from hashlib import blake2b
 from pathlib import Path
+from time import monotonic, time
+from typing import TYPE_CHECKING, Self
+from urllib.parse import urlsplit
+from uuid import uuid4
 
 from agno.agent import (
     Agent,
     RunContentEvent,
+    RunOutput,
+    RunOutputEvent,
     ToolCallCompletedEvent,
     ToolCallStartedEvent,
 )
 from agno.db import BaseDb
-from agno.db.json import JsonDb
-from agno.guardrails import PIIDetectionGuardrail, PromptInjectionGuardrail
+from agno.guardrails import (
+    BaseGuardrail,
+    PIIDetectionGuardrail,
+    PromptInjectionGuardrail,
+)
 from agno.knowledge.knowledge import Knowledge
 from agno.models.message import Message
 from agno.models.openai.like import OpenAILike
+from agno.run import RunStatus
+from agno.run.agent import RunInput
+from agno.session import AgentSession
 from agno.tools import Toolkit
 from agno.tools.mcp import MultiMCPTools
 from agno.vectordb.qdrant import Qdrant
+from anyio import open_file
 from gradio import (
     Audio,
     Blocks,
     ChatInterface,
-    ChatMessage,
     Error,
+    MessageDict,
+    Request,
     Video,
 )
-from gradio.components.chatbot import MetadataDict
-from m3u8 import M3U8, load
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Response, Timeout, codes
+from m3u8 import M3U8, loads as parse_playlist
+from orjson import dumps, loads
 from poml import poml
-from pydantic import HttpUrl, ValidationError
-from requests import Session
 from rich.pretty import pprint
 
-from chattr.app.settings import Settings, logger
+from chattr.app.cache import SemanticCache
+from chattr.app.database import OrjsonDb
+from chattr.app.settings import Settings, get_settings, logger
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterable, Iterator
+
+    from agno.models.response import ToolExecution
+    from numpy import float32
+    from numpy.typing import NDArray
+
+AGENT_DESCRIPTION: str = (
+    "You are a helpful assistant who can act and mimic Napoleon's character"
+    " and answer questions about the era."
+)
+AGENT_INSTRUCTIONS: list[str] = [
+    "Understand the user's question and context.",
+    "Gather relevant information and resources.",
+    "Formulate a clear and concise response in Napoleon's voice.",
+    "ALWAYS generate audio from the formulated response using the appropriate Tool.",
+    "Generate video from the resulted audio using the appropriate Tool.",
+]
+# The guardrails are stateless, so their patterns are compiled once and shared.
+AGENT_GUARDRAILS: list[BaseGuardrail] = [
+    PIIDetectionGuardrail(),
+    PromptInjectionGuardrail(),
+]
+_AGENT_CACHE: dict[str, Agent] = {}
+_AGENT_LOCK: Lock = Lock()
+_MCP_TOOLS_CACHE: dict[str, MultiMCPTools] = {}
+_VECTOR_DATABASE_CACHE: dict[tuple[str, str | None], Qdrant] = {}
+# Tools whose result is an audio or video file to show in the chat.
+_MEDIA_TOOLS: frozenset[str] = frozenset(
+    {"generate_audio_for_text", "generate_video_mcp"},
+)
+# Files larger than this many bytes are downloaded in parallel parts.
+_RANGE_DOWNLOAD_SIZE: int = 8 * 1024 * 1024
+_RANGE_DOWNLOAD_PARTS: int = 4
+# Each downloaded chunk is written from a worker thread, so chunks are large.
+_DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+# Content deltas arriving within this many seconds are rendered together.
+_STREAM_INTERVAL: float = 0.05
+# Seconds between checks that the MCP sessions of the agent are still alive.
+_MCP_CHECK_INTERVAL: float = 30.0
+# Agent sessions of the least recently active chats are forgotten past this.
+_MAX_SESSIONS: int = 1024
+
+
+@lru_cache(maxsize=8)
+def _load_mcp_servers(path: Path, mtime_ns: int) -> list[dict]:  # noqa: ARG001
+    """
+    Return the MCP servers of a config file, parsed once per modification.
+
+    Args:
+        path: The MCP config file.
+        mtime_ns: The modification time of the file, so edits are picked up.
+
+    Returns:
+        list[dict]: The configured MCP servers.
+    """
+    return loads(path.read_bytes()).get("mcp_servers", [])
+
+
+async def _prefetch(
+    events: AsyncIterator[RunOutputEvent],
+    queue: Queue[RunOutputEvent | None],
+) -> None:
+    """
+    Move the events of an agent run into a queue as soon as they arrive.
+
+    Args:
+        events: The events streamed by the agent.
+        queue: The queue to put the events in, followed by None once the run
+               ends or fails.
+    """
+    try:
+        async for event in events:
+            queue.put_nowait(event)
+    finally:
+        queue.put_nowait(None)
+
+
+async def _check_guardrails(message: str) -> None:
+    """
+    Check a user message with the guardrails of the agent.
+
+    Args:
+        message: The user's input message.
+
+    Raises:
+        InputCheckError: If a guardrail rejects the message.
+    """
+    run_input = RunInput(input_content=message)
+    for guardrail in AGENT_GUARDRAILS:
+        await guardrail.async_check(run_input)
+
+
+def _message_text(message: MessageDict) -> str:
+    """
+    Return the text of a chat message, without its files and components.
+
+    Args:
+        message: The chat message.
+
+    Returns:
+        str: The text of the message.
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part["text"] for part in content if part.get("type") == "text")
+
+
+def _run_text(run: RunOutput) -> str | None:
+    """
+    Return the user message an agent run answered.
+
+    Args:
+        run: The agent run.
+
+    Returns:
+        str | None: The user message, or None if the run stopped before it
+            recorded one.
+    """
+    for message in run.messages or []:
+        if message.role == "user" and not message.from_history:
+            return message.content
+    return None
+
+
+def _cancel(tasks: Iterable[Task]) -> None:
+    """
+    Cancel tasks, leaving the finished ones untouched.
+
+    Args:
+        tasks: The tasks to cancel.
+    """
+    for task in tasks:
+        task.cancel()
 
 
 class App:
@@ -42,45 +206,200 @@ class App:
 
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
+        self.mcp_tools: MultiMCPTools | None = None
+        self.mcp_checked: float = float("-inf")
+        # Failed connection attempts to the media servers are retried, as the
+        # downloads happen after the tool has already produced the file.
+        self.http_client = AsyncClient(
+            transport=AsyncHTTPTransport(
+                http2=True,
+                limits=Limits(max_connections=32, max_keepalive_connections=16),
+                retries=3,
+            ),
+            timeout=Timeout(60.0, connect=5.0),
+            follow_redirects=True,
+        )
+        # HTTP/2 multiplexes requests over one connection, so the parts of a
+        # file are downloaded over HTTP/1.1 to get a connection each.
+        self.range_client = AsyncClient(
+            transport=AsyncHTTPTransport(retries=3),
+            timeout=Timeout(60.0, connect=5.0),
+            follow_redirects=True,
+        )
+        # Media downloads of concurrent responses share a limited number of
+        # connections, which keeps the media servers from throttling the app.
+        self.download_slots = Semaphore(8)
+        # The agent session of the conversation shown to each Gradio session,
+        # most recently active last.
+        self.sessions: OrderedDict[str | None, str] = OrderedDict()
+        self.cache: SemanticCache | None = (
+            SemanticCache(
+                model_name=settings.cache.model,
+                threshold=settings.cache.threshold,
+                max_entries=settings.cache.max_entries,
+            )
+            if settings.cache.enabled
+            else None
+        )
+
+    @classmethod
+    async def create(cls, settings: Settings) -> Self:
+        """
+        Create an app with its agent already set up on the running event loop.
+
+        The MCP connections and the knowledge base are set up concurrently, so
+        callers already running an event loop get a ready app without nesting
+        another loop.
+
+        Args:
+            settings: The application settings.
+
+        Returns:
+            Self: The app with its agent set up.
+        """
+        app = cls(settings)
+        await app._setup_agent()
+        return app
+
+    def _mcp_servers(self) -> list[dict]:
+        """
+        Return the configured MCP servers.
+
+        Returns:
+            list[dict]: The MCP servers of the config file.
+        """
+        path: Path = self.settings.mcp.path
+        return _load_mcp_servers(path, path.stat().st_mtime_ns)
+
+    def _url_servers(self) -> list[dict]:
+        """
+        Return the configured MCP servers reached over a URL.
+
+        Returns:
+            list[dict]: The URL MCP servers of the config file.
+        """
+        return [m for m in self._mcp_servers() if m.get("type") == "url"]
+
+    def _agent_key(self) -> str:
+        """
+        Compute the cache key of the agent for the current configuration.
+
+        The key covers every setting the agent is built from, so editing a
+        server URL or transport, the model or the memory settings builds a new
+        agent instead of reusing the stale one. The API key only enters as a
+        digest, so it is never held in the cache key.
+
+        Returns:
+            str: Digest of the MCP servers and the agent settings.
+        """
+        model = self.settings.model
+        api_key: str = model.api_key.get_secret_value() if model.api_key else ""
+        signature: dict = {
+            "mcp_servers": self._url_servers(),
+            "model": model.model_dump(mode="json", exclude={"api_key"}),
+            "api_key": blake2b(api_key.encode()).hexdigest(),
+            "memory": self.settings.memory.model_dump(mode="json"),
+            "vector_database": self.settings.vector_database.model_dump(mode="json"),
+            "debug": self.settings.debug,
+        }
+        return blake2b(dumps(signature)).hexdigest()
 
     async def _setup_agent(self) -> Agent:
+        """
+        Return the agent for the current configuration, building it on first use.
+
+        Agents are cached by the MCP servers and settings they are built from, so
+        app instances sharing a configuration reuse the same agent instead of
+        rebuilding it on every response. The first build is guarded by a lock,
+        so concurrent first requests wait for a single build. The MCP sessions
+        of the agent are pinged at most every 30 seconds, rather than before
+        every message, and reconnected if they dropped.
+
+        Returns:
+            Agent: The configured agent.
+        """
+        key: str = self._agent_key()
+        if (agent := _AGENT_CACHE.get(key)) is None:
+            async with _AGENT_LOCK:
+                # Another request may have built the agent while this one waited.
+                if (agent := _AGENT_CACHE.get(key)) is None:
+                    agent = await self._build_agent()
+                    _AGENT_CACHE[key] = agent
+        self.mcp_tools = agent.tools[0]
+        if monotonic() - self.mcp_checked < _MCP_CHECK_INTERVAL:
+            return agent
+        self.mcp_checked = monotonic()
+        if not await self.mcp_tools.is_alive():
+            async with _AGENT_LOCK:
+                # Another request may have reconnected it while this one waited.
+                if not await self.mcp_tools.is_alive():
+                    logger.warning("MCP servers disconnected, reconnecting...")
+                    await self.mcp_tools.connect(force=True)
+        return agent
+
+    async def _build_agent(self) -> Agent:
+        # The agent sessions and the knowledge contents share one database.
+        db: OrjsonDb = self._setup_database()
+        # Connecting the MCP servers is network bound, so the knowledge base is
+        # built in a worker thread while the connections are established.
+        tools, knowledge = await gather(
+            self._setup_tools(),
+            to_thread(
+                lambda: self._setup_knowledge(self._setup_vector_database(), db),
+            ),
+        )
         return Agent(
             model=self._setup_model(),
-            tools=await self._setup_tools(),
-            description="You are a helpful assistant who can act and mimic Napoleon's character and answer questions about the era.",
-            instructions=[
-                "Understand the user's question and context.",
-                "Gather relevant information and resources.",
-                "Formulate a clear and concise response in Napoleon's voice.",
-                "ALWAYS generate audio from the formulated response using the appropriate Tool.",
-                "Generate video from the resulted audio using the appropriate Tool.",
-            ],
-            db=self._setup_database(),
-            knowledge=self._setup_knowledge(
-                self._setup_vector_database(),
-                self._setup_database(),
-            ),
+            tools=tools,
+            description=AGENT_DESCRIPTION,
+            instructions=AGENT_INSTRUCTIONS,
+            db=db,
+            knowledge=knowledge,
             markdown=True,
             add_datetime_to_context=True,
             timezone_identifier="Africa/Cairo",
-            pre_hooks=[PIIDetectionGuardrail(), PromptInjectionGuardrail()],
-            debug_mode=True,
-            save_response_to_file="agno/response.txt",
+            pre_hooks=AGENT_GUARDRAILS,
+            debug_mode=self.settings.debug,
+            save_response_to_file="agno/response.txt" if self.settings.debug else None,
             add_history_to_context=True,
+            # Only the latest runs are replayed, so the prompt stays bounded as
+            # the conversation grows. Older runs can be kept as a summary.
+            num_history_runs=self.settings.memory.history_runs,
+            # Replayed tool calls only repeat their arguments and media URLs.
+            max_tool_calls_from_history=self.settings.memory.history_tools,
+            enable_session_summaries=self.settings.memory.summarize,
+            add_session_summary_to_context=self.settings.memory.summarize,
+            # Keep the latest session in memory instead of reloading it from the
+            # database on every run of the same conversation. The shared agent
+            # has a single slot for it, so this only saves the reload when one
+            # conversation is active, as in single-user deployments; with
+            # several users, each run of another conversation loads its own.
+            cache_session=True,
             add_memories_to_context=True,
         )
 
     async def _setup_tools(self) -> list[Toolkit]:
-        mcp_servers: list[dict] = loads(self.settings.mcp.path.read_text()).get(
-            "mcp_servers",
-            [],
-        )
-        url_servers = [m for m in mcp_servers if m.get("type") == "url"]
-        self.mcp_tools = MultiMCPTools(
-            urls=[m.get("url") for m in url_servers],
-            urls_transports=[m.get("transport") for m in url_servers],
-        )
+        """
+        Return the MCP toolkit for the configured servers, connecting it once.
+
+        The connected toolkit is shared by every app instance with the same
+        servers and kept open across responses, so the MCP sessions stay warm
+        instead of being re-established on every message.
+
+        Returns:
+            list[Toolkit]: The MCP toolkit.
+        """
+        url_servers: list[dict] = self._url_servers()
+        key: str = blake2b(dumps(url_servers)).hexdigest()
+        if (mcp_tools := _MCP_TOOLS_CACHE.get(key)) is None:
+            mcp_tools = MultiMCPTools(
+                urls=[m.get("url") for m in url_servers],
+                urls_transports=[m.get("transport") for m in url_servers],
+            )
+            _MCP_TOOLS_CACHE[key] = mcp_tools
+        self.mcp_tools = mcp_tools
         await self.mcp_tools.connect()
+        self.mcp_checked = monotonic()
         return [self.mcp_tools]
 
     def _setup_prompt(self) -> str:
@@ -114,6 +433,11 @@ class App:
                 id=self.settings.model.name,
                 api_key=self.settings.model.api_key.get_secret_value(),
                 temperature=self.settings.model.temperature,
+                # Lets llama.cpp/vLLM style servers reuse the cached KV of the
+                # unchanged prompt prefix instead of prefilling it every turn.
+                extra_body={"cache_prompt": True}
+                if self.settings.model.cache_prompt
+                else None,
             )
         except Exception as e:
             _msg: str = f"Failed to initialize ChatOpenAI model: {e}"
@@ -121,10 +445,23 @@ class App:
             raise Error(_msg) from e
 
     def _setup_vector_database(self) -> Qdrant:
-        return Qdrant(
-            collection=self.settings.vector_database.name,
-            url=self.settings.vector_database.url.host,
+        """
+        Return the vector database client, creating it once per collection.
+
+        Agents built for different models share the client and its connection
+        pool instead of opening a new one per build.
+
+        Returns:
+            Qdrant: The vector database client.
+        """
+        key: tuple[str, str | None] = (
+            self.settings.vector_database.name,
+            self.settings.vector_database.url.host,
         )
+        if (vector_db := _VECTOR_DATABASE_CACHE.get(key)) is None:
+            vector_db = Qdrant(collection=key[0], url=key[1])
+            _VECTOR_DATABASE_CACHE[key] = vector_db
+        return vector_db
 
     def _setup_knowledge(self, vector_db: Qdrant, db: BaseDb) -> Knowledge:
         return Knowledge(
@@ -132,8 +469,8 @@ class App:
             contents_db=db,
         )
 
-    def _setup_database(self) -> JsonDb:
-        return JsonDb(
+    def _setup_database(self) -> OrjsonDb:
+        return OrjsonDb(
             db_path="agno",
         )
 
@@ -149,128 +486,452 @@ class App:
     async def generate_response(
         self,
         message: str,
-        history: list[ChatMessage],
-    ) -> AsyncGenerator[tuple[str, list[ChatMessage], Path | None, Path | None]]:
+        history: list[MessageDict],
+        request: Request,
+    ) -> AsyncGenerator[list[MessageDict | Audio | Video]]:
         """
-        Generate a response to a user message and update the conversation history.
+        Generate a response to a user message.
 
-        This asynchronous method streams responses from the state graph and
-        yields updated history and audio file paths as needed.
+        This asynchronous method streams events from the agent and yields the
+        messages of this turn whenever an event updates them. Gradio appends
+        them to the chat history itself, so only this turn's messages are sent
+        on each update instead of the whole conversation. Content deltas are
+        appended to the current reply as they arrive and yielded at most every
+        50 ms. Generated audio and video are downloaded in the background while
+        the reply keeps streaming, and replace their placeholders once the run
+        has finished, or a note if their download failed. When the semantic
+        cache is enabled, a cached reply to a similar message of the same user,
+        or of the same browser session for anonymous users, is returned
+        without running the agent, once the message passed the guardrails, and
+        is recorded in the agent session like any other run.
 
         Args:
             message: The user's input message as a string.
-            history: The conversation history as a list of ChatMessage objects.
+            history: The conversation shown in the chat, which the agent
+                     session is kept in step with.
+            request: The Gradio request, whose session and user identify the
+                     agent session the message belongs to.
 
         Returns:
-            AsyncGenerator: Yields a tuple containing an
-                            empty string, the updated history, and
-                            a Path to an audio file if generated.
+            AsyncGenerator: Yields the messages of this turn.
+
+        Raises:
+            Error: If the message is empty or the response fails.
         """
+        if not message.strip():
+            msg = "Please enter a message."
+            raise Error(msg)
         try:
             agent: Agent = await self._setup_agent()
-            async for response in agent.arun(
-                Message(content=message, role="user"),
-                stream=True,
-            ):
-                pprint(response)
-                if isinstance(response, RunContentEvent):
-                    history.append(
-                        ChatMessage(
-                            role="assistant",
-                            content=response.content,
-                        ),
-                    )
-                elif isinstance(response, ToolCallStartedEvent):
-                    history.append(
-                        ChatMessage(
-                            role="assistant",
-                            content=dumps(response.tool.tool_args, indent=4),
-                            metadata=MetadataDict(
-                                title=response.tool.tool_name,
-                                id=response.tool.tool_call_id,
-                                duration=response.tool.created_at,
-                            ),
-                        ),
+            user_id: str = request.username or "anonymous"
+            session_id: str = await self._setup_session(
+                agent,
+                history,
+                request,
+                user_id,
+            )
+            # Anonymous users only share cached replies within their session.
+            cache_key: str | None = request.username or request.session_hash
+            if self.cache and cache_key:
+                prompt: NDArray[float32] = await to_thread(self.cache.embed, message)
+                if cached := self.cache.get(cache_key, prompt):
+                    # Cached replies skip the agent run and with it its
+                    # pre-hooks, which check the messages sent to the agent.
+                    await _check_guardrails(message)
+                    await self._save_cached_run(
+                        agent,
+                        session_id,
+                        user_id,
+                        message,
+                        cached,
                     )
-                elif isinstance(response, ToolCallCompletedEvent):
-                    if response.tool.tool_call_error:
-                        history.append(
-                            ChatMessage(
-                                role="assistant",
-                                content=dumps(response.tool.tool_args, indent=4),
-                                metadata=MetadataDict(
-                                    title=response.tool.tool_name,
-                                    id=response.tool.tool_call_id,
-                                    log="Tool Call Failed",
-                                    duration=response.tool.metrics.duration,
-                                ),
-                            ),
-                        )
-                    else:
-                        history.append(
-                            ChatMessage(
-                                role="assistant",
-                                content=dumps(response.tool.tool_args, indent=4),
-                                metadata=MetadataDict(
-                                    title=response.tool.tool_name,
-                                    id=response.tool.tool_call_id,
-                                    log="Tool Call Succeeded",
-                                    duration=response.tool.metrics.duration,
-                                ),
-                            ),
+                    yield [{"role": "assistant", "content": cached}]
+                    return
+            # Content deltas are accumulated into the same message until a tool
+            # call interrupts the reply.
+            reply: MessageDict | None = None
+            messages: list[MessageDict | Audio | Video] = []
+            pending: bool = False
+            last_yield: float = monotonic()
+            # Media downloads by the index of their placeholder in the messages.
+            media: dict[int, Task[Audio | Video]] = {}
+            try:
+                # The event stream is closed as soon as the response stops, so
+                # the agent run is cancelled right away instead of on collection.
+                async with aclosing(
+                    self._stream_events(agent, message, session_id, user_id),
+                ) as events:
+                    async for response in events:
+                        reply, updated = self._apply_event(
+                            response,
+                            messages,
+                            reply,
+                            media,
                         )
-                        if response.tool.tool_name == "generate_audio_for_text":
-                            history.append(
-                                Audio(
-                                    response.tool.result,
-                                    autoplay=True,
-                                    show_download_button=True,
-                                    show_share_button=True,
-                                ),
-                            )
-                        elif response.tool.tool_name == "generate_video_mcp":
-                            history.append(
-                                Video(
-                                    response.tool.result,
-                                    autoplay=True,
-                                    show_download_button=True,
-                                    show_share_button=True,
-                                ),
-                            )
-                        else:
-                            msg = f"Unknown tool name: {response.tool.tool_name}"
-                            raise Error(msg)
-                yield history
+                        pending = pending or updated
+                        # Content deltas are coalesced so the chatbot is not
+                        # re-rendered for every token, while tool calls are
+                        # shown as soon as they happen.
+                        if pending and (
+                            not isinstance(response, RunContentEvent)
+                            or monotonic() - last_yield >= _STREAM_INTERVAL
+                        ):
+                            yield messages
+                            pending = False
+                            last_yield = monotonic()
+                for index, task in media.items():
+                    messages[index] = await self._await_media(task)
+            finally:
+                # Downloads still running when the run fails, a download fails
+                # or the response is stopped are not needed anymore.
+                _cancel(media.values())
+            if pending or media:
+                yield messages
+            # The text of the reply is split around the tool calls of the run.
+            text: str = "\n\n".join(
+                m["content"]
+                for m in messages
+                if isinstance(m, dict) and "metadata" not in m
+            )
+            if self.cache and cache_key and text:
+                self.cache.set(cache_key, prompt, text)
         except Exception as e:
             _msg: str = f"Error generating response: {e}"
             logger.error(_msg)
             raise Error(_msg) from e
+
+    async def _setup_session(
+        self,
+        agent: Agent,
+        history: list[MessageDict],
+        request: Request,
+        user_id: str,
+    ) -> str:
+        """
+        Return the agent session of the conversation, in step with the chat.
+
+        A new agent session is started with every new conversation, so a
+        cleared chat does not carry the context of the previous one. Retrying,
+        undoing or editing a message drops the later turns from the chat, so
+        the runs of the agent session that no longer match the chat are marked
+        as regenerated, as agno does for its own regenerated runs, and are not
+        replayed as history anymore. The sessions of the 1024 most recently
+        active chats are remembered.
+
+        Args:
+            agent: The agent running the conversation.
+            history: The conversation shown in the chat.
+            request: The Gradio request identifying the chat.
+            user_id: The user of the conversation.
+
+        Returns:
+            str: The id of the agent session.
+        """
+        if not history or request.session_hash not in self.sessions:
+            self.sessions[request.session_hash] = uuid4().hex
+            self.sessions.move_to_end(request.session_hash)
+            if len(self.sessions) > _MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+            return self.sessions[request.session_hash]
+        self.sessions.move_to_end(request.session_hash)
+        session_id: str = self.sessions[request.session_hash]
+        session: AgentSession | None = await agent.aget_session(session_id, user_id)
+        if session is None:
+            return session_id
+        # Stopped or rejected messages stay in the chat without a completed run,
+        # so each run is matched to the next chat message with its content, and
+        # the runs left without a match are the ones dropped from the chat.
+        turns: Iterator[str] = iter(
+            [_message_text(m) for m in history if m["role"] == "user"],
+        )
+        stale: bool = False
+        for run in session.runs or []:
+            if run.parent_run_id is not None or run.status == RunStatus.regenerated:
+                continue
+            if (text := _run_text(run)) is not None and text not in turns:
+                run.status = RunStatus.regenerated
+                stale = True
+        if stale:
+            await agent.asave_session(session)
+        return session_id
+
+    async def _save_cached_run(
+        self,
+        agent: Agent,
+        session_id: str,
+        user_id: str,
+        message: str,
+        reply: str,
+    ) -> None:
+        """
+        Record a reply served from the semantic cache as a run of the session.
+
+        The exchange is then replayed as history on the next message, as if
+        the agent had answered it.
+
+        Args:
+            agent: The agent running the conversation.
+            session_id: The agent session of the conversation.
+            user_id: The user sending the message.
+            message: The user's input message.
+            reply: The cached reply.
+        """
+        agent.set_id()
+        session: AgentSession | None = await agent.aget_session(session_id, user_id)
+        if session is None:
+            session = AgentSession(
+                session_id=session_id,
+                agent_id=agent.id,
+                user_id=user_id,
+                session_data={},
+                created_at=int(time()),
+            )
+        session.upsert_run(
+            RunOutput(
+                run_id=str(uuid4()),
+                agent_id=agent.id,
+                session_id=session_id,
+                user_id=user_id,
+                input=RunInput(input_content=message),
+                content=reply,
+                messages=[
+                    Message(role="user", content=message),
+                    Message(role="assistant", content=reply),
+                ],
+                status=RunStatus.completed,
+            ),
+        )
+        await agent.asave_session(session)
+
+    async def _stream_events(
+        self,
+        agent: Agent,
+        message: str,
+        session_id: str,
+        user_id: str,
+    ) -> AsyncGenerator[RunOutputEvent]:
+        """
+        Stream the events of an agent run on a user message.
+
+        The run is consumed by a separate task, so the next events keep being
+        received from the model while the current ones are rendered.
+
+        Args:
+            agent: The agent to run.
+            message: The user's input message.
+            session_id: The agent session of the conversation.
+            user_id: The user sending the message.
+
+        Returns:
+            AsyncGenerator: Yields the events of the run.
+        """
+        queue: Queue[RunOutputEvent | None] = Queue()
+        producer: Task[None] = create_task(
+            _prefetch(
+                agent.arun(
+                    Message(content=message, role="user"),
+                    session_id=session_id,
+                    user_id=user_id,
+                    stream=True,
+                    stream_events=True,
+                ),
+                queue,
+            ),
+        )
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+            # Raises the error of the run, if it failed.
+            await producer
         finally:
-            await self._close()
+            producer.cancel()
+
+    def _apply_event(
+        self,
+        response: RunOutputEvent,
+        messages: list[MessageDict | Audio | Video],
+        reply: MessageDict | None,
+        media: dict[int, Task[Audio | Video]],
+    ) -> tuple[MessageDict | None, bool]:
+        """
+        Apply a streamed agent event to the messages of the current turn.
+
+        Args:
+            response: The event streamed by the agent.
+            messages: The messages of the current turn to update.
+            reply: The assistant message currently being streamed, if any.
+            media: The pending media downloads, by the index of their
+                   placeholder in the messages.
+
+        Returns:
+            tuple[MessageDict | None, bool]: The assistant message to stream the
+                next content delta into, or None if a new one must be started,
+                and whether the messages were updated.
+        """
+        if self.settings.debug:
+            pprint(response)
+        if isinstance(response, RunContentEvent):
+            if not response.content:
+                return reply, False
+            if reply is None:
+                reply = {"role": "assistant", "content": ""}
+                messages.append(reply)
+            reply["content"] += response.content
+            return reply, True
+        if isinstance(response, ToolCallStartedEvent):
+            tool: ToolExecution = response.tool
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": dumps(tool.tool_args).decode(),
+                    "metadata": {
+                        "title": tool.tool_name,
+                        "id": tool.tool_call_id,
+                        "duration": tool.created_at,
+                    },
+                },
+            )
+            return None, True
+        if isinstance(response, ToolCallCompletedEvent):
+            tool = response.tool
+            failed: bool = bool(tool.tool_call_error)
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": dumps(tool.tool_args).decode(),
+                    "metadata": {
+                        "title": tool.tool_name,
+                        "id": tool.tool_call_id,
+                        "log": "Tool Call Failed" if failed else "Tool Call Succeeded",
+                        "duration": tool.metrics.duration,
+                    },
+                },
+            )
+            if not failed and tool.tool_name in _MEDIA_TOOLS:
+                media[len(messages)] = create_task(self._setup_media(tool))
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": "",
+                        "metadata": {"title": "Downloading media", "status": "pending"},
+                    },
+                )
+            return None, True
+        return reply, False
+
+    async def _await_media(
+        self,
+        task: Task[Audio | Video],
+    ) -> MessageDict | Audio | Video:
+        """
+        Wait for a media download, showing its failure instead of raising it.
+
+        The reply and the other media of the turn are still shown when a
+        download fails.
+
+        Args:
+            task: The media download.
+
+        Returns:
+            MessageDict | Audio | Video: The media component, or a message
+                telling the download failed.
+        """
+        try:
+            return await task
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Error downloading media: {e}")
+            return {
+                "role": "assistant",
+                "content": str(e),
+                "metadata": {
+                    "title": "Downloading media",
+                    "log": "Download Failed",
+                    "status": "done",
+                },
+            }
 
     def _is_url(self, value: str | None) -> bool:
         """
-        Check if a string is a valid URL.
+        Check if a tool result is an HTTP(S) URL.
+
+        Tool results are either URLs or local file paths, so a prefix check
+        tells most of them apart, and only strings with an HTTP(S) prefix are
+        split to check that they name a host.
 
         Args:
             value: The string to check. Can be None.
 
         Returns:
-            bool: True if the string is a valid URL, False otherwise.
+            bool: True if the string is an HTTP(S) URL, False otherwise.
         """
-        if value is None:
-            return False
+        return (
+            isinstance(value, str)
+            and value.startswith(("http://", "https://"))
+            and bool(urlsplit(value).netloc)
+        )
 
-        try:
-            _ = HttpUrl(value)
-        except ValidationError:
-            return False
-        return True
+    async def _setup_media(self, tool: ToolExecution) -> Audio | Video:
+        """
+        Create the media component for the result of a media generation tool.
+
+        Args:
+            tool: The completed tool execution.
+
+        Returns:
+            Audio | Video: The component playing the generated media.
+
+        Raises:
+            Error: If the tool is not a known media generation tool.
+        """
+        if tool.tool_name == "generate_audio_for_text":
+            return Audio(
+                await self._fetch_media(
+                    tool.result,
+                    self.settings.directory.audio / f"{tool.tool_call_id}.wav",
+                ),
+                autoplay=True,
+                buttons=["download", "share"],
+            )
+        if tool.tool_name == "generate_video_mcp":
+            return Video(
+                await self._fetch_media(
+                    tool.result,
+                    self.settings.directory.video / f"{tool.tool_call_id}.mp4",
+                ),
+                autoplay=True,
+                buttons=["download", "share"],
+            )
+        msg = f"Unknown tool name: {tool.tool_name}"
+        raise Error(msg)
+
+    async def _fetch_media(self, source: str | None, path: Path) -> str | Path | None:
+        """
+        Download a media tool result to a local path when it is a URL.
 
-    def _download_file(self, url: HttpUrl, path: Path) -> None:
+        Args:
+            source: The tool result, either a URL or a local file path.
+            path: The local file path where a remote file will be saved.
+
+        Returns:
+            str | Path | None: The local path of the media file.
+        """
+        if not self._is_url(source):
+            return source
+        await self._download_file(source, path)
+        return path
+
+    async def _download_file(self, url: str, path: Path) -> None:
         """
         Download a file from a URL and save it to a local path.
 
+        The file is streamed through the shared HTTP client, so connections are
+        reused across downloads, with at most eight open at a time, and written
+        to disk from a worker thread one chunk at a time, so the event loop is
+        never blocked by the disk. Large files served with range support are
+        downloaded in parts over parallel HTTP/1.1 connections, and downloaded
+        whole again if the server ignores the ranges. A failed part cancels the
+        others.
+
         Args:
             url: The URL to download the file from.
             path: The local file path where the downloaded file will be saved.
@@ -279,26 +940,122 @@ class App:
             None
 
         Raises:
-            requests.RequestException: If the HTTP request fails.
+            httpx.HTTPError: If the HTTP request fails.
             IOError: If file writing fails.
+            ExceptionGroup: If downloading a part fails.
         """
-        if str(url).endswith(".m3u8"):
-            _playlist: M3U8 = load(url)
-            url: str = str(url).replace("playlist.m3u8", _playlist.segments[0].uri)
+        if url.endswith(".m3u8"):
+            _response: Response = await self.http_client.get(url)
+            _response.raise_for_status()
+            _playlist: M3U8 = parse_playlist(_response.text)
+            url = url.replace("playlist.m3u8", _playlist.segments[0].uri)
         logger.info(f"Downloading {url} to {path}")
-        session = Session()
-        response = session.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        with path.open("wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        async with self.download_slots:
+            # Ranges count bytes of the encoded body, so it is requested as is.
+            head: Response = await self.http_client.head(
+                url,
+                headers={"Accept-Encoding": "identity"},
+            )
+        size: int = int(head.headers.get("content-length", 0))
+        if (
+            head.is_success
+            and head.headers.get("accept-ranges") == "bytes"
+            and size > _RANGE_DOWNLOAD_SIZE
+        ):
+            async with await open_file(path, "wb") as f:
+                await f.truncate(size)
+            part: int = -(-size // _RANGE_DOWNLOAD_PARTS)
+            async with TaskGroup() as group:
+                ranged: list[Task[bool]] = [
+                    group.create_task(
+                        self._download_range(
+                            url,
+                            path,
+                            start,
+                            min(start + part, size) - 1,
+                        ),
+                    )
+                    for start in range(0, size, part)
+                ]
+            if all(task.result() for task in ranged):
+                logger.info(f"File downloaded to {path}")
+                return
+            logger.warning(f"{url} ignored the requested ranges, downloading it whole")
+        await self._download_range(url, path)
         logger.info(f"File downloaded to {path}")
 
+    async def _download_range(
+        self,
+        url: str,
+        path: Path,
+        start: int = 0,
+        end: int | None = None,
+    ) -> bool:
+        """
+        Download a byte range of a file into its place in a local file.
+
+        Each download holds one of the download slots while its connection is
+        open. Ranges are requested through the HTTP/1.1 client, so each one
+        gets a connection of its own.
+
+        Args:
+            url: The URL to download the file from.
+            path: The local file to write to. It is created unless a range
+                  is given, in which case it must already exist.
+            start: The first byte of the range.
+            end: The last byte of the range, or None to download the whole file.
+
+        Returns:
+            bool: False if the server did not serve the requested range, in
+                  which case nothing is written.
+
+        Raises:
+            httpx.HTTPError: If the HTTP request fails.
+            IOError: If file writing fails.
+        """
+        headers: dict[str, str] = {}
+        if end is not None:
+            headers = {"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"}
+        client: AsyncClient = self.http_client if end is None else self.range_client
+        async with (
+            self.download_slots,
+            client.stream("GET", url, headers=headers) as response,
+        ):
+            response.raise_for_status()
+            if end is not None and (
+                response.status_code != codes.PARTIAL_CONTENT
+                or not response.headers.get("content-range", "").startswith(
+                    f"bytes {start}-{end}/",
+                )
+            ):
+                return False
+            async with await open_file(path, "wb" if end is None else "r+b") as f:
+                await f.seek(start)
+                async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+        return True
+
     async def _close(self) -> None:
+        """
+        Close the HTTP clients of the app and the shared MCP toolkits.
+
+        The MCP toolkits are shared process-wide, so they are all closed and
+        dropped from the cache together with the agents using them, and the
+        next app set up connects them again.
+
+        Raises:
+            Error: If the MCP toolkits fail to close.
+        """
+        await gather(self.http_client.aclose(), self.range_client.aclose())
+        self.mcp_tools = None
+        if not _MCP_TOOLS_CACHE:
+            return
+        toolkits: list[MultiMCPTools] = list(_MCP_TOOLS_CACHE.values())
+        _MCP_TOOLS_CACHE.clear()
+        _AGENT_CACHE.clear()
         try:
             logger.info("Closing MCP tools...")
-            await self.mcp_tools.close()
+            await gather(*(toolkit.close() for toolkit in toolkits))
         except Exception as e:
             msg: str = (
                 f"Error closing MCP tools: {e}, Check if the Tool services are running."
@@ -308,8 +1065,7 @@ class App:
 
 
 async def test() -> None:
-    settings: Settings = Settings()
-    app: App = App(settings)
+    app: App = await App.create(get_settings())
     agent: Agent = await app._setup_agent()
     try:
         await agent.aprint_response("Hello!", debug_mode=True)
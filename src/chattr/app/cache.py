@@ -0,0 +1,106 @@
+"""Semantic cache of the agent responses."""
+
+from collections import deque
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from fastembed import TextEmbedding
+from numpy import float32, vstack
+from numpy.linalg import norm
+
+from chattr.app.logger import logger
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+
+class SemanticCache:
+    """
+    In-memory cache of responses keyed by the user and the embedding of their prompt.
+
+    Responses are personalized, so a user is only answered with the responses
+    to their own prompts. The oldest response of all users is evicted first.
+    """
+
+    def __init__(self, model_name: str, threshold: float, max_entries: int) -> None:
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._model: TextEmbedding | None = None
+        self._model_lock = Lock()
+        self._vectors: dict[str, NDArray[float32]] = {}
+        self._responses: dict[str, list[str]] = {}
+        # The users of the cached responses, from the oldest to the newest.
+        self._order: deque[str] = deque()
+
+    def embed(self, prompt: str) -> NDArray[float32]:
+        """
+        Embed a prompt into a unit-length vector.
+
+        The embedding model is loaded on first use, as loading it may download
+        the model weights.
+
+        Args:
+            prompt: The prompt to embed.
+
+        Returns:
+            NDArray[float32]: The normalized embedding of the prompt.
+        """
+        with self._model_lock:
+            if self._model is None:
+                logger.info("Loading embedding model %s.", self.model_name)
+                self._model = TextEmbedding(self.model_name)
+            vector: NDArray[float32] = next(iter(self._model.embed([prompt])))
+        return vector / norm(vector)
+
+    def get(self, user_id: str, vector: NDArray[float32]) -> str | None:
+        """
+        Return the cached response of the most similar prompt of a user.
+
+        Args:
+            user_id: The user sending the prompt.
+            vector: The normalized embedding of the prompt.
+
+        Returns:
+            str | None: The cached response if a prompt of the user is similar
+                        enough, None otherwise.
+        """
+        if (vectors := self._vectors.get(user_id)) is None:
+            return None
+        scores: NDArray[float32] = vectors @ vector
+        best: int = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        logger.info("Semantic cache hit with a similarity of %.3f.", scores[best])
+        return self._responses[user_id][best]
+
+    def set(self, user_id: str, vector: NDArray[float32], response: str) -> None:
+        """
+        Cache a response, evicting the oldest entry when the cache is full.
+
+        Args:
+            user_id: The user who sent the prompt.
+            vector: The normalized embedding of the prompt.
+            response: The response to cache.
+        """
+        if (vectors := self._vectors.get(user_id)) is None:
+            self._vectors[user_id] = vector[None, :]
+        else:
+            self._vectors[user_id] = vstack([vectors, vector])
+        self._responses.setdefault(user_id, []).append(response)
+        self._order.append(user_id)
+        if len(self._order) > self.max_entries:
+            self._evict(self._order.popleft())
+
+    def _evict(self, user_id: str) -> None:
+        """
+        Drop the oldest cached response of a user.
+
+        Args:
+            user_id: The user whose oldest response is dropped.
+        """
+        if len(self._responses[user_id]) == 1:
+            del self._vectors[user_id], self._responses[user_id]
+            return
+        self._vectors[user_id] = self._vectors[user_id][1:]
+        self._responses[user_id].pop(0)
@@ -0,0 +1,66 @@
+"""JSON database of the agent backed by orjson."""
+
+from typing import Any
+
+from agno.db.json import JsonDb
+from orjson import (
+    OPT_NON_STR_KEYS,
+    OPT_PASSTHROUGH_DATACLASS,
+    OPT_PASSTHROUGH_DATETIME,
+    JSONDecodeError,
+    dumps,
+    loads,
+)
+
+from chattr.app.logger import logger
+
+# Keep the output compatible with `json.dump(..., default=str)` used upstream.
+_DUMPS_OPTIONS: int = (
+    OPT_NON_STR_KEYS | OPT_PASSTHROUGH_DATACLASS | OPT_PASSTHROUGH_DATETIME
+)
+
+
+class OrjsonDb(JsonDb):
+    """JsonDb that reads and writes its tables with orjson instead of json."""
+
+    def _read_json_file(
+        self,
+        filename: str,
+        create_table_if_not_found: bool | None = True,  # noqa: FBT001, FBT002
+    ) -> list[dict[str, Any]]:
+        """
+        Read a table from its JSON file, creating the file if it doesn't exist.
+
+        Args:
+            filename: The name of the JSON file to read.
+            create_table_if_not_found: Whether to create a missing file.
+
+        Returns:
+            list[dict[str, Any]]: The rows of the table.
+
+        Raises:
+            JSONDecodeError: If the JSON file is not valid.
+        """
+        file_path = self.db_path / f"{filename}.json"
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        try:
+            return loads(file_path.read_bytes())
+        except FileNotFoundError:
+            if create_table_if_not_found:
+                file_path.write_bytes(b"[]")
+            return []
+        except JSONDecodeError as e:
+            logger.error("Error reading the %s JSON file: %s", file_path, e)
+            raise
+
+    def _write_json_file(self, filename: str, data: list[dict[str, Any]]) -> None:
+        """
+        Write a table to its JSON file.
+
+        Args:
+            filename: The name of the JSON file to write.
+            data: The rows of the table.
+        """
+        file_path = self.db_path / f"{filename}.json"
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(dumps(data, default=str, option=_DUMPS_OPTIONS))
@@ -1,5 +1,19 @@
+from functools import lru_cache
+
 from chattr.app.builder import App
-from chattr.app.settings import Settings
+from chattr.app.settings import get_settings
+
+
+@lru_cache(maxsize=1)
+def get_app() -> App:
+    """
+    Return the app, creating it on first use.
+
+    Loading the settings validates the MCP config and creates the missing
+    directories, so it is deferred until the app is needed instead of running
+    on import.
 
-settings: Settings = Settings()
-app: App = App(settings)
+    Returns:
+        App: The application.
+    """
+    return App(get_settings())
@@ -1,5 +1,6 @@
 """Settings for the Chattr app."""
 
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import Self
 
@@ -27,6 +28,18 @@ class MemorySettings(BaseModel):
 
     collection_name: str = Field(default="memories")
     embedding_dims: int = Field(default=384)
+    history_runs: int = Field(default=3, gt=0)
+    history_tools: int = Field(default=2, ge=0)
+    summarize: bool = Field(default=False)
+
+
+class CacheSettings(BaseModel):
+    """Settings for the semantic response cache."""
+
+    enabled: bool = Field(default=False)
+    model: str = Field(default="BAAI/bge-small-en-v1.5")
+    threshold: float = Field(default=0.95, ge=0.0, le=1.0)
+    max_entries: int = Field(default=1024, gt=0)
 
 
 class VectorDatabaseSettings(BaseModel):
@@ -41,26 +54,16 @@ class MCPSettings(BaseModel):
 
     path: FilePath = Field(default_factory=lambda: Path.cwd() / "mcp.json")
 
-    @model_validator(mode="after")
-    def is_exists(self) -> Self:
-        """Check if the MCP config file exists."""
-        if not self.path.exists():
-            logger.warning("`mcp.json` not found.")
-        return self
-
     @model_validator(mode="after")
     def is_valid(self) -> Self:
-        """Validate that the MCP config file is a JSON file."""
-        if self.path and self.path.suffix != ".json":
+        """Validate that the MCP config file is a JSON file with a valid scheme."""
+        if self.path.suffix != ".json":
             msg = "MCP config file must be a JSON file"
             raise ValueError(msg)
-        return self
-
-    @model_validator(mode="after")
-    def is_valid_scheme(self) -> Self:
-        """Validate that the MCP config file has a valid scheme."""
-        if self.path and self.path.exists():
-            _ = MCPScheme.model_validate_json(self.path.read_text())
+        if not self.path.exists():
+            logger.warning("`mcp.json` not found.")
+            return self
+        _ = MCPScheme.model_validate_json(self.path.read_bytes())
         return self
 
 
@@ -69,26 +72,27 @@ class DirectorySettings(BaseModel):
 
     base: DirectoryPath = Field(default_factory=Path.cwd, frozen=True)
 
+    # The base directory is frozen, so each path is only built once.
     @computed_field
-    @property
+    @cached_property
     def assets(self) -> DirectoryPath:
         """Path to the assets directory."""
         return self.base / "assets"
 
     @computed_field
-    @property
+    @cached_property
     def audio(self) -> DirectoryPath:
         """Path to the audio directory."""
         return self.assets / "audio"
 
     @computed_field
-    @property
+    @cached_property
     def video(self) -> DirectoryPath:
         """Path to the video directory."""
         return self.assets / "video"
 
     @computed_field
-    @property
+    @cached_property
     def prompts(self) -> DirectoryPath:
         """Path to the prompts directory."""
         return self.assets / "prompts"
@@ -99,11 +103,13 @@ class DirectorySettings(BaseModel):
         Ensure that all specified directories exist, creating them if necessary.
 
         Checks and creates any missing directories defined in the `DirectorySettings`.
+        Only the leaf directories are checked, as creating them creates their
+        parents.
 
         Returns:
             Self: The validated DirectorySettings instance.
         """
-        for directory in [self.base, self.assets, self.audio, self.video, self.prompts]:
+        for directory in [self.audio, self.video, self.prompts]:
             if not directory.exists():
                 try:
                     directory.mkdir(parents=True, exist_ok=True)
@@ -121,6 +127,7 @@ class ModelSettings(BaseModel):
     name: str | None = Field(default=None)
     api_key: SecretStr | None = Field(default=None)
     temperature: float = Field(default=0.0, ge=0.0, le=1.0)
+    cache_prompt: bool = Field(default=False)
 
     @model_validator(mode="after")
     def check_api_key_exist(self) -> Self:
@@ -172,6 +179,7 @@ class Settings(BaseSettings):
     directory: DirectorySettings = Field(default_factory=DirectorySettings, frozen=True)
     model: ModelSettings = Field(default_factory=ModelSettings)
     memory: MemorySettings = Field(default_factory=MemorySettings)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
     vector_database: VectorDatabaseSettings = Field(
         default_factory=VectorDatabaseSettings,
     )
@@ -180,7 +188,18 @@ class Settings(BaseSettings):
     debug: bool = Field(default=False)
 
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Return the settings of the app, loading them once per process.
+
+    Returns:
+        Settings: The loaded settings.
+    """
+    return Settings()
+
+
 if __name__ == "__main__":
     from rich import print as rprint
 
-    rprint(Settings().model_dump_json(indent=4))
+    rprint(get_settings().model_dump_json(indent=4))
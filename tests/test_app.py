@@ -1,19 +1,44 @@
 """This module contains tests for the application's HTTP endpoints."""
 
+from __future__ import annotations
+
 from os import getenv
+from typing import TYPE_CHECKING
+
+import pytest
+from requests import Response, Session
 
-from requests import Response, head
+if TYPE_CHECKING:
+    from collections.abc import Iterator
 
 
-def test_app() -> None:
+@pytest.fixture(scope="session")
+def http() -> Iterator[Session]:
+    """
+    Provide an HTTP session shared by the tests, so connections are reused.
+
+    Yields:
+        Session: The shared HTTP session.
+    """
+    with Session() as session:
+        yield session
+
+
+@pytest.mark.parametrize("url", [getenv("CHATTR_URL", "http://localhost:7860/")])
+def test_app(http: Session, url: str) -> None:
     """
     Test the reachability of Chattr.
 
+    The page is requested with GET without reading its body, as servers may
+    close the connection after a HEAD request instead of keeping it alive.
+
+    Args:
+        http: The shared HTTP session.
+        url: The URL of the Chattr endpoint to probe.
+
     Returns:
         None
     """
-    response: Response = head(
-        getenv("CHATTR_URL", "http://localhost:7860/"),
-        timeout=30,
-    )
-    assert response.status_code == 200
+    response: Response
+    with http.get(url, timeout=30, stream=True) as response:
+        assert response.status_code == 200
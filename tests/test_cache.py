@@ -0,0 +1,81 @@
+"""This module contains tests for the semantic cache of the agent responses."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+from numpy import eye, float32
+
+from chattr.app.cache import SemanticCache
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+# Orthogonal unit vectors standing in for the embeddings of unrelated prompts.
+PROMPTS: NDArray[float32] = eye(4, dtype=float32)
+
+
+@pytest.fixture
+def cache() -> SemanticCache:
+    """
+    Provide a cache holding at most two responses.
+
+    Returns:
+        SemanticCache: The empty cache.
+    """
+    return SemanticCache(model_name="unused", threshold=0.9, max_entries=2)
+
+
+def test_get_similar(cache: SemanticCache) -> None:
+    """
+    Test that a response is returned for its own prompt only.
+
+    Args:
+        cache: The cache under test.
+
+    Returns:
+        None
+    """
+    assert cache.get("user", PROMPTS[0]) is None
+    cache.set("user", PROMPTS[0], "first")
+    cache.set("user", PROMPTS[1], "second")
+    assert cache.get("user", PROMPTS[0]) == "first"
+    assert cache.get("user", PROMPTS[1]) == "second"
+    assert cache.get("user", PROMPTS[2]) is None
+
+
+def test_get_other_user(cache: SemanticCache) -> None:
+    """
+    Test that the responses of a user are not returned to another one.
+
+    Args:
+        cache: The cache under test.
+
+    Returns:
+        None
+    """
+    cache.set("user", PROMPTS[0], "first")
+    assert cache.get("other", PROMPTS[0]) is None
+
+
+def test_set_evicts_oldest(cache: SemanticCache) -> None:
+    """
+    Test that the oldest response of all users is evicted when the cache is full.
+
+    Args:
+        cache: The cache under test.
+
+    Returns:
+        None
+    """
+    cache.set("user", PROMPTS[0], "first")
+    cache.set("other", PROMPTS[1], "second")
+    cache.set("user", PROMPTS[2], "third")
+    assert cache.get("user", PROMPTS[0]) is None
+    assert cache.get("other", PROMPTS[1]) == "second"
+    assert cache.get("user", PROMPTS[2]) == "third"
+    cache.set("user", PROMPTS[3], "fourth")
+    assert cache.get("other", PROMPTS[1]) is None
+    assert cache.get("user", PROMPTS[2]) == "third"
+    assert cache.get("user", PROMPTS[3]) == "fourth"